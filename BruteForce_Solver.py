@@ -18,7 +18,7 @@ def solve(puzzle, count_calls=False):
     # solve the puzzle
     calls = [0]
     result = solve_rec(puzzle, 0, 0, calls)
-    if not result.is_solved:
+    if not result.is_solved():
         result = None
     if count_calls:
         return result, calls[0]
@@ -29,36 +29,58 @@ def solve(puzzle, count_calls=False):
 def solve_rec(puzzle, row, col, calls):
     """
     Solve the given Ripple Effect puzzle using brute force depth first search,
-    start from the top left corner of the puzzle.
+    start from the top left corner of the puzzle. The search is run with an
+    explicit stack of (row, col, remaining numbers) frames instead of
+    recursion, and calls counts each square visited as one call.
     :param puzzle: the Ripple Effect puzzle being solved
     :param row: the current row
     :param col: the current column
     :param calls: the number of times solve_rec() has been called
     :return: The solved Ripple Effect puzzle
     """
-    calls[0] += 1
-    if puzzle.is_solved():
+    square = find_empty(puzzle, row, col, calls)
+    if square is None:
         return puzzle
 
-    if col >= puzzle.width:
-        col = 0
-        row += 1
+    stack = [(square[0], square[1], iter(range(1, puzzle.get_region_size(square) + 1)))]
+    while stack:
+        row, col, nums = stack[-1]
+        for num in nums:
+            if puzzle.test(row, col, num):
+                break
+        else:
+            # every number has been tried, so undo this square
+            puzzle.backtrack(row, col)
+            stack.pop()
+            continue
 
-    if row >= puzzle.height:
-        if puzzle.is_solved():
+        square = find_empty(puzzle, row, col + 1, calls)
+        if square is None:
             return puzzle
-
-    if puzzle[row][col] != ".":
-        return solve_rec(puzzle, row, col + 1, calls)
-    else:
-        num = 0
-        max_num = len(puzzle.get_region((row, col)))
-        while num < max_num:
-            num += 1
-            if puzzle.test(row, col, num):
-                solve_rec(puzzle, row, col + 1, calls)
-            if puzzle.is_solved():
-                return puzzle
-        puzzle.backtrack(row, col)
+        stack.append((square[0], square[1], iter(range(1, puzzle.get_region_size(square) + 1))))
 
     return puzzle
+
+
+def find_empty(puzzle, row, col, calls):
+    """
+    Find the first empty square at or after the square (row, col), reading
+    the puzzle left to right, top to bottom.
+    :param puzzle: the Ripple Effect puzzle being solved
+    :param row: the row to start from
+    :param col: the column to start from
+    :param calls: the number of times solve_rec() has been called
+    :return: the first empty square, or None if the puzzle is solved
+    """
+    while True:
+        calls[0] += 1
+        if puzzle.is_solved():
+            return None
+
+        if col >= puzzle.width:
+            col = 0
+            row += 1
+
+        if puzzle[row][col] == 0:
+            return row, col
+        col += 1
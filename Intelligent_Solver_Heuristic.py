@@ -1,11 +1,23 @@
 """
 file: Intelligent_Solver_Heuristic.py
 description: Solve a Ripple Effect puzzle with an intelligent solver using
-the minimum-remaining-values heuristic.
+the minimum-remaining-values heuristic. The remaining possible values of each
+square are stored as a 16 bit mask, so regions can hold at most MAX_VALUE
+squares.
 """
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import numpy as np
+from numba import njit
 
+# the largest value a 16 bit mask of remaining possible values can hold
+MAX_VALUE = 15
 
-def solve(puzzle, count_calls=False):
+# the number of bits set in each possible 16 bit mask
+POPCOUNT = np.unpackbits(np.arange(1 << 16, dtype=">u2").view(np.uint8)).reshape(-1, 16).sum(axis=1, dtype=np.uint8)
+
+
+def solve(puzzle, count_calls=False, workers=1, lcv=False):
     """
     Start by finding the remaining possible values for each square in the
     puzzle. Then, call solve_rec() to solve the given puzzle, passing the
@@ -13,79 +25,39 @@ def solve(puzzle, count_calls=False):
     keeping track of the number of times solve_rec() is called. Then, if
     the puzzle has been solved, return the solved puzzle, otherwise return
     None. If count_calls is true, also return the number of calls to
-    solve_rec().
+    solve_rec(). If workers is more than 1, the branches for each value of
+    the first square are searched in parallel by that many threads; this is
+    only available when calling solve() directly, as Ripple.py always
+    searches with one thread. If lcv is true, the values of each square are
+    tried in least-constraining-value order instead of increasing order.
     :param puzzle: the Ripple Effect puzzle to solve
     :param count_calls: whether to return the number of calls to solve_rec()
+    :param workers: the number of threads to search with
+    :param lcv: whether to use the least-constraining-value heuristic
     :return: the solved puzzle if it is possible, None otherwise
              if count_calls == true, also return the number of calls to solve_rec()
     """
-    rows = dict()
-    cols = dict()
-    regions = dict()
-    remaining_dict = dict()
-
-    # initialize cols dictionary
-    for col in range(puzzle.width):
-        cols[col] = set()
-
-    # fill the rows dictionary and cols dictionary
-    for row in range(puzzle.height):
-        rows[row] = set()
-        for col in range(puzzle.width):
-            num = puzzle[row][col]
-            if type(num) == int:
-                rows[row].add(num)
-                cols[col].add(num)
-
-    # get the numbers in each region
-    for region in puzzle.regions:
-        regions[region] = set()
-        for square in region:
-            num = puzzle.get(square)
-            if type(num) == int:
-                regions[region].add(num)
+    # the remaining possible values for each square are stored as a bitmask,
+    # with bit n set if n can still be placed in that square
+    domains = np.zeros((puzzle.height, puzzle.width), dtype=np.uint16)
 
     # get the range of possible values for each square
-    for region in regions:
-        possible = set(range(1, len(region) + 1))
-        for num in regions[region]:
-            possible.remove(num)
-
-        for square in region:
-            if puzzle.get(square) == ".":
-                remaining_dict[square] = set(possible)
-            else:
-                remaining_dict[square] = puzzle.get(square)
+    for region in puzzle.regions:
+        domains[region] = (1 << (region[0].size + 1)) - 2
 
     # reduce remaining possible values
-    row_squares = []
-    col_squares = []
-    for row in range(puzzle.height):
-        for col in range(puzzle.width):
-            num = puzzle[row][col]
-            if type(num) == int:
-                # check row
-                row_squares.append([(row, x) for x in range(puzzle.width)])
-                for square in row_squares[-1]:
-                    if type(remaining_dict[square]) != int:
-                        if abs(square[1] - col) <= num:
-                            remaining_dict[square].discard(num)
-
-                # check col
-                col_squares.append([(x, col) for x in range(puzzle.height)])
-                for square in col_squares[-1]:
-                    if type(remaining_dict[square]) != int:
-                        if abs(square[0] - row) <= num:
-                            remaining_dict[square].discard(num)
-
-    # create array of squares to solve
-    remaining = [[square, remaining_dict[square]] for square in remaining_dict if type(remaining_dict[square]) != int]
-    remaining = sorted(remaining, key=lambda l: (len(l[1]), l[0], l))
+    for row, col in zip(*np.nonzero(puzzle.puzzle)):
+        prune(domains, row, col, int(puzzle[row][col]), puzzle)
+    domains[puzzle.puzzle != 0] = 0
 
     # solve the puzzle
     calls = [0]
-    result = solve_rec(puzzle, remaining, calls)
-    if not result.is_solved:
+    result = solve_rec(puzzle, domains, calls, workers, lcv)
+    if not result.is_solved():
+        result = None
+    elif workers > 1 and not result.is_consistent():
+        # the branches of a parallel search share their inputs, so check the
+        # solution they produced rather than trusting it
         result = None
     if count_calls:
         return result, calls[0]
@@ -93,63 +65,305 @@ def solve(puzzle, count_calls=False):
         return result
 
 
-def update_remaining(remaining, row, col, value, puzzle):
+def warm_up():
     """
-    Update the array of remaining possible values for each square and sort it
-    by number of remaining possible values.
-    :param remaining: the array of remaining possible values for each square
-    :param row: the row of the last value added
-    :param col: the column of the last value added
-    :param value: the last value added
-    :param puzzle: the Ripple Effect puzzle being solved
-    :return: the new array of remaining possible values for each square
+    Run the compiled functions used by solve() once on a one square puzzle,
+    so that Numba's compilation, or the loading of its cache, is not counted
+    in the time of the first real solve. The argument types match the ones
+    solve_rec() passes, so the same compiled versions are reused.
+    :return: None
     """
-    region_squares = set(puzzle.get_region((row, col)))
-    new_remaining = []
-    for elem in remaining:
-        temp = set(elem[1])
-        # check row
-        if elem[0][0] == row:
-            dif = abs(col - elem[0][1])
-            if dif <= value:
-                temp.discard(value)
-        # check col
-        if elem[0][1] == col:
-            dif = abs(row - elem[0][0])
-            if dif <= value:
-                temp.discard(value)
-
-        # check region
-        if elem[0] in region_squares:
-            temp.discard(value)
+    influence_idx, influence_count = index_influence(np.ones((1, 2, 1), dtype=np.bool_))
+    grid = np.zeros(1, dtype=np.int8)
+    domains = np.full(1, 2, dtype=np.uint16)
+    stop = np.zeros(1, dtype=np.bool_)
+    search(grid, domains, influence_idx, influence_count, False, stop)
 
-        new_remaining.append([elem[0], temp])
 
-    return sorted(new_remaining, key=lambda l: (len(l[1]), l[0], l))
+def prune(domains, row, col, value, puzzle):
+    """
+    Remove value from the remaining possible values of every square that can
+    no longer hold it now that value has been placed at (row, col), using the
+    puzzle's precomputed influence masks. domains is updated in place.
+    :param domains: the bitmasks of remaining possible values for each square
+    :param row: the row of the value placed
+    :param col: the column of the value placed
+    :param value: the value placed
+    :param puzzle: the Ripple Effect puzzle being solved
+    :return: None
+    """
+    squares = domains.reshape(-1)
+    squares[puzzle.influence[row, col, value]] &= np.uint16(~(1 << value) & 0xFFFF)
 
 
-def solve_rec(puzzle, remaining, calls):
+def solve_rec(puzzle, domains, calls, workers=1, lcv=False):
     """
     Solve the given Ripple Effect puzzle using depth first search, picking the
-    next target square using the minimum-remaining-values heuristic.
+    next target square using the minimum-remaining-values heuristic. The
+    search itself is run by the compiled search() function, working on the
+    flattened puzzle in place.
     :param puzzle: the Ripple Effect puzzle being solved
-    :param remaining: the array of remaining possible values for each square
+    :param domains: the bitmasks of remaining possible values for each square
     :param calls: the number of times solve_rec() has been called
+    :param workers: the number of threads to search with
+    :param lcv: whether to use the least-constraining-value heuristic
     :return: The solved Ripple Effect puzzle
     """
-    calls[0] += 1
-    if puzzle.is_solved():
-        return puzzle
-
-    current = remaining[0]
-    row = current[0][0]
-    col = current[0][1]
-    for num in current[1]:
-        if puzzle.test(row, col, num):
-            new_remaining = update_remaining(remaining[1:], row, col, num, puzzle)
-            solve_rec(puzzle, new_remaining, calls)
-        if puzzle.is_solved():
-            return puzzle
-    puzzle.backtrack(row, col)
-
+    # list the squares influenced by each placement, so that a placement
+    # only has to visit those squares rather than the whole puzzle
+    n_squares = puzzle.width * puzzle.height
+    influence_idx, influence_count = index_influence(puzzle.influence.reshape(n_squares, -1, n_squares))
+    grid = puzzle.puzzle.reshape(-1)
+    if workers > 1 and np.any(grid == 0):
+        calls[0] += search_parallel(grid, domains.reshape(-1), influence_idx, influence_count, workers, lcv)
+    else:
+        stop = np.zeros(1, dtype=np.bool_)
+        calls[0] += search(grid, domains.reshape(-1), influence_idx, influence_count, lcv, stop)
+    puzzle.sync()
     return puzzle
+
+
+def search_parallel(grid, domains, influence_idx, influence_count, workers, lcv):
+    """
+    Split the search on the values of the first square picked, and search
+    each branch on its own copy of the puzzle in a thread pool. search()
+    releases the GIL, so the branches run concurrently. Every branch copies
+    the puzzle as it was before the pool started, the first branch to find a
+    solution stops the others, and only that solution is copied into grid
+    once every branch has finished. Since the branches race, the number of
+    calls can differ between runs.
+    :param grid: the flattened puzzle, with empty squares stored as 0
+    :param domains: the bitmasks of remaining possible values for each square
+    :param influence_idx: influence_idx[square, value] lists the squares that
+                          can no longer hold value once it is placed in square
+    :param influence_count: the number of squares listed in each entry of
+                            influence_idx
+    :param workers: the number of threads to search with
+    :param lcv: whether to use the least-constraining-value heuristic
+    :return: the number of squares visited by the search
+    """
+    square = select_square(grid, domains)
+    order = np.empty(MAX_VALUE + 1, dtype=np.int64)
+    n_values = order_values(grid, domains, square, influence_idx, influence_count, lcv, order)
+    start_grid = grid.copy()
+    stop = np.zeros(1, dtype=np.bool_)
+    solution = []
+    lock = Lock()
+
+    def search_branch(value):
+        if stop[0]:
+            return 0
+        branch_grid = start_grid.copy()
+        branch_domains = np.empty_like(domains)
+        if place_and_prune(branch_grid, domains, branch_domains, square, value, influence_idx, influence_count):
+            # forward checking found a dead end
+            return 0
+        branch_calls = search(branch_grid, branch_domains, influence_idx, influence_count, lcv, stop)
+        if not np.any(branch_grid == 0):
+            with lock:
+                if not solution:
+                    solution.append(branch_grid)
+                    stop[0] = True
+        return branch_calls
+
+    calls = 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        calls += sum(pool.map(search_branch, order[:n_values].tolist()))
+    if solution:
+        grid[:] = solution[0]
+    return calls
+
+
+@njit(cache=True)
+def index_influence(influence):
+    """
+    Convert the influence masks into lists of the squares influenced by each
+    placement.
+    :param influence: influence[square, value] is a mask of the squares that
+                      can no longer hold value once it is placed in square
+    :return: an array where influence_idx[square, value] lists the squares
+             set in influence[square, value], and the number of squares in
+             each list
+    """
+    n_squares, n_values, _ = influence.shape
+    influence_count = np.zeros((n_squares, n_values), dtype=np.int64)
+    for square in range(n_squares):
+        for value in range(n_values):
+            influence_count[square, value] = np.count_nonzero(influence[square, value])
+
+    influence_idx = np.zeros((n_squares, n_values, influence_count.max()), dtype=np.int64)
+    for square in range(n_squares):
+        for value in range(n_values):
+            count = 0
+            for other in range(n_squares):
+                if influence[square, value, other]:
+                    influence_idx[square, value, count] = other
+                    count += 1
+    return influence_idx, influence_count
+
+
+@njit(cache=True)
+def select_square(grid, domains):
+    """
+    Pick the next square to fill using the minimum-remaining-values heuristic,
+    breaking ties by the position of the square. This is a single pass over
+    the squares, with the number of remaining values read from POPCOUNT. The
+    pass stops at the first square with at most one remaining value, since
+    forward checking keeps every empty square from having none.
+    :param grid: the flattened puzzle
+    :param domains: the bitmasks of remaining possible values for each square
+    :return: the index of the empty square with the fewest remaining values
+    """
+    best = -1
+    best_count = MAX_VALUE + 1
+    for square in range(grid.size):
+        if grid[square] == 0:
+            count = POPCOUNT[domains[square]]
+            if count < best_count:
+                best = square
+                best_count = count
+                if count <= 1:
+                    break
+    return best
+
+
+@njit(cache=True)
+def order_values(grid, domains, square, influence_idx, influence_count, lcv, order):
+    """
+    Order the remaining possible values of the given square. If lcv is true,
+    the least-constraining-value heuristic is used: values that would be
+    removed from the fewest other empty squares are tried first, breaking
+    ties by value. Otherwise the values are in increasing order.
+    :param grid: the flattened puzzle
+    :param domains: the bitmasks of remaining possible values for each square
+    :param square: the square whose values are ordered
+    :param influence_idx: influence_idx[square, value] lists the squares that
+                          can no longer hold value once it is placed in square
+    :param influence_count: the number of squares listed in each entry of
+                            influence_idx
+    :param lcv: whether to use the least-constraining-value heuristic
+    :param order: the array the ordered values are written to
+    :return: the number of values written to order
+    """
+    mask = domains[square]
+    costs = np.empty(MAX_VALUE + 1, dtype=np.int64)
+    n_values = 0
+    for value in range(1, MAX_VALUE + 1):
+        if not (mask >> value) & 1:
+            continue
+        cost = 0
+        for i in range(influence_count[square, value] if lcv else 0):
+            other = influence_idx[square, value, i]
+            if other != square and grid[other] == 0 and (domains[other] >> value) & 1:
+                cost += 1
+
+        # insert value into order, keeping it sorted by cost
+        pos = n_values
+        while pos > 0 and costs[pos - 1] > cost:
+            order[pos] = order[pos - 1]
+            costs[pos] = costs[pos - 1]
+            pos -= 1
+        order[pos] = value
+        costs[pos] = cost
+        n_values += 1
+    return n_values
+
+
+@njit(cache=True, nogil=True)
+def place_and_prune(grid, domains, new_domains, square, value, influence_idx, influence_count):
+    """
+    Place value in the given square, then write the remaining possible values
+    after the placement to new_domains: a copy of domains with value pruned
+    from every square it influences. Only the influenced squares can lose
+    their last value, so only they are checked for a dead end.
+    :param grid: the flattened puzzle, with empty squares stored as 0
+    :param domains: the bitmasks of remaining possible values before the placement
+    :param new_domains: the array the bitmasks after the placement are written to
+    :param square: the square to place value in
+    :param value: the value to place
+    :param influence_idx: influence_idx[square, value] lists the squares that
+                          can no longer hold value once it is placed in square
+    :param influence_count: the number of squares listed in each entry of
+                            influence_idx
+    :return: whether an empty square was left with no remaining values
+    """
+    grid[square] = value
+    for other in range(domains.size):
+        new_domains[other] = domains[other]
+    keep = np.uint16(~(1 << value) & 0xFFFF)
+    dead_end = False
+    for i in range(influence_count[square, value]):
+        other = influence_idx[square, value, i]
+        new_domains[other] &= keep
+        if grid[other] == 0 and new_domains[other] == 0:
+            dead_end = True
+    return dead_end
+
+
+@njit(cache=True, nogil=True)
+def search(grid, domains, influence_idx, influence_count, lcv, stop):
+    """
+    Run the depth first search with forward checking over the flattened
+    puzzle, using an explicit stack indexed by depth. The values of each
+    square are tried in the order given by order_values(). After each
+    placement, the value is pruned from every square it influences, and the
+    placement is abandoned if one of those squares is left empty with no
+    remaining values. grid is left solved if a solution is found, or
+    unchanged otherwise. If stop[0] is set by another thread, the search
+    gives up, leaving grid partly filled.
+    :param grid: the flattened puzzle, with empty squares stored as 0
+    :param domains: the bitmasks of remaining possible values for each square
+    :param influence_idx: influence_idx[square, value] lists the squares that
+                          can no longer hold value once it is placed in square
+    :param influence_count: the number of squares listed in each entry of
+                            influence_idx
+    :param lcv: whether to use the least-constraining-value heuristic
+    :param stop: a one element flag array checked before each placement
+    :return: the number of squares visited by the search
+    """
+    calls = 1
+    n_empty = np.count_nonzero(grid == 0)
+    if n_empty == 0:
+        return calls
+
+    # squares[depth] is the square filled at depth, orders[depth] the values to try there,
+    # tried[depth] how many of them have been tried, and domain_stack[depth] the
+    # remaining possible values before filling it
+    squares = np.empty(n_empty, dtype=np.int64)
+    orders = np.empty((n_empty, MAX_VALUE + 1), dtype=np.int64)
+    n_values = np.empty(n_empty, dtype=np.int64)
+    tried = np.zeros(n_empty, dtype=np.int64)
+    domain_stack = np.empty((n_empty, grid.size), dtype=np.uint16)
+    domain_stack[0] = domains
+    depth = 0
+    squares[0] = select_square(grid, domains)
+    n_values[0] = order_values(grid, domains, squares[0], influence_idx, influence_count, lcv, orders[0])
+    while depth >= 0 and not stop[0]:
+        square = squares[depth]
+        if tried[depth] == n_values[depth]:
+            # every value has been tried, so undo this square
+            grid[square] = 0
+            depth -= 1
+            continue
+
+        value = orders[depth, tried[depth]]
+        tried[depth] += 1
+        if depth + 1 == n_empty:
+            grid[square] = value
+            return calls + 1
+
+        # the next depth's domains are written over its row of the stack, so
+        # backtracking needs no undo
+        new_domains = domain_stack[depth + 1]
+        if place_and_prune(grid, domain_stack[depth], new_domains, square, value, influence_idx, influence_count):
+            # forward checking found a dead end, so try the next value
+            continue
+
+        calls += 1
+        depth += 1
+        squares[depth] = select_square(grid, new_domains)
+        n_values[depth] = order_values(grid, new_domains, squares[depth], influence_idx, influence_count, lcv,
+                                       orders[depth])
+        tried[depth] = 0
+
+    return calls
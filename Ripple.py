@@ -4,9 +4,12 @@ description: Solve the Ripple Effect puzzle in each file given on the command
 line, first with a brute force solver, then with an intelligent solver using
 the minimum-remaining-values heuristic, then compare their respective times
 to run, and number of calls to their solve functions.
+
+Requires numpy, and numba for the intelligent solver's compiled search.
 """
 import sys
 import time
+import numpy as np
 import BruteForce_Solver as BruteForce
 import Intelligent_Solver_Heuristic as Heuristic
 
@@ -17,22 +20,51 @@ class Puzzle:
     Description: Puzzle holds a Ripple Effect puzzle and provides methods for
                  interacting with said puzzle.
     """
-    def __init__(self, width, height, puzzle, puzzle_str, regions, region_map):
+    def __init__(self, width, height, puzzle, puzzle_str, regions, region_id, influence):
         self.width = width
         self.height = height
         self.puzzle = puzzle
         self.puzzle_str = puzzle_str
         self.regions = regions
-        self.region_map = region_map
-        self.solved = False
+        self.region_id = region_id
+        self.region_size = np.array([region[0].size for region in regions])[region_id]
+        self.influence = influence
+
+        # masks of the positions within each distance of each position, fixed
+        # by the dimensions of the puzzle
+        max_num = int(self.region_size.max())
+        self.row_windows = [[self.within(col, num) for num in range(max_num + 1)] for col in range(width)]
+        self.col_windows = [[self.within(row, num) for num in range(max_num + 1)] for row in range(height)]
+
         self.empty_slots_left = 0
-        for row in puzzle:
-            for elem in row:
-                if elem == ".":
-                    self.empty_slots_left += 1
+        self.row_masks = []
+        self.col_masks = []
+        self.region_masks = []
+        self.sync()
+
+    def sync(self):
+        """
+        Recompute the number of empty squares and the row, column and region
+        masks from the puzzle array, after it has been changed directly.
+        row_masks[row][num] has bit col set if num is at (row, col),
+        col_masks[col][num] has bit row set if num is at (row, col), and
+        region_masks[region] has bit num set if num is in that region.
+        :return: None
+        """
+        self.empty_slots_left = int(np.count_nonzero(self.puzzle == 0))
+        max_num = int(self.region_size.max())
+        self.row_masks = [[0] * (max_num + 1) for _ in range(self.height)]
+        self.col_masks = [[0] * (max_num + 1) for _ in range(self.width)]
+        self.region_masks = [0] * len(self.regions)
+        for row, col in np.argwhere(self.puzzle).tolist():
+            num = int(self.puzzle[row, col])
+            self.row_masks[row][num] |= 1 << col
+            self.col_masks[col][num] |= 1 << row
+            self.region_masks[self.region_id[row, col]] |= 1 << num
 
     def __str__(self):
         result = ""
+        squares = [[str(num) if num != 0 else "." for num in row] for row in self.puzzle.tolist()]
         walls = True
         for i in range(len(self.puzzle_str)):
             if walls:
@@ -40,35 +72,23 @@ class Puzzle:
                 result += self.puzzle_str[i] + "\n"
             else:
                 walls = True
-                result += str.format(self.puzzle_str[i], self.puzzle) + "\n"
+                result += str.format(self.puzzle_str[i], squares) + "\n"
         return result
 
     def __repr__(self):
         return str(self)
 
-    def get_region(self, square):
+    def get_region_size(self, square):
         """
-        Return the region containing the given square.
+        Return the number of squares in the region containing the given square.
         :param square: the given square
-        :return: the region containing the given square,
-                 or None if it does not exist
+        :return: the size of the region containing the given square
         """
-        if square in self.region_map:
-            return self.region_map[square]
-        else:
-            return None
+        return int(self.region_size[square[0], square[1]])
 
     def __getitem__(self, row):
         return self.puzzle[row]
 
-    def get(self, square):
-        """
-        Return the value at the given square within this puzzle.
-        :param square: the given square
-        :return: the value at the given square
-        """
-        return self.puzzle[square[0]][square[1]]
-
     def test(self, row, col, num):
         """
         Test if the given number is valid if placed at the given row and column
@@ -78,57 +98,74 @@ class Puzzle:
         :param num: the number to test placing
         :return: whether the number is valid if placed at the given row and column
         """
-        temp = self.puzzle[row][col]
-        self.puzzle[row][col] = num
-        if self.is_valid(row, col):
-            self.empty_slots_left -= 1
+        temp = int(self.puzzle[row, col])
+        if temp != 0:
+            self.backtrack(row, col)
+        if self.is_valid_for(row, col, num):
+            self.place(row, col, num)
             return True
         else:
-            self.puzzle[row][col] = temp
+            if temp != 0:
+                self.place(row, col, temp)
             return False
 
-    def is_valid(self, row, col, check_region=True):
+    def place(self, row, col, num):
+        """
+        Place the given number at the given empty square, updating the
+        masks used by is_valid_for().
+        :param row: the given row
+        :param col: the given column
+        :param num: the number to place
+        :return: None
+        """
+        self.puzzle[row, col] = num
+        self.empty_slots_left -= 1
+        self.row_masks[row][num] |= 1 << col
+        self.col_masks[col][num] |= 1 << row
+        self.region_masks[self.region_id[row, col]] |= 1 << num
+
+    def is_valid_for(self, row, col, num):
         """
-        Check if the row at the given index and the column at the given index
-        are valid. If check_region is true, check if the region containing the
-        square (row, col) is valid.
+        Check if the given number can be placed at the empty square (row, col).
+        Only num can be made invalid by placing it, so this only checks for
+        another num within num of the square on its row or column, using the
+        row and column masks and the precomputed windows, and for another num
+        in its region, using the region masks.
         :param row: the row index
         :param col: the column index
-        :param check_region: whether to check the region
-        :return: whether the row, column, and region (if checked) are all valid
+        :param num: the number to place
+        :return: whether num can be placed at (row, col)
         """
-        # check row
-        prev = dict()
-        for p_col in range(len(self.puzzle[row])):
-            elem = self.puzzle[row][p_col]
-            if type(elem) == int:
-                if elem not in prev:
-                    prev[elem] = [p_col]
-                else:
-                    for col_idx in prev[elem]:
-                        if p_col - col_idx <= elem:
-                            return False
-                    prev[elem].append(p_col)
-
-        # check col
-        prev = dict()
-        for p_row in range(len(self.puzzle)):
-            elem = self.puzzle[p_row][col]
-            if type(elem) == int:
-                if elem not in prev:
-                    prev[elem] = [p_row]
-                else:
-                    for row_idx in prev[elem]:
-                        if p_row - row_idx <= elem:
-                            return False
-                    prev[elem].append(p_row)
+        if self.row_masks[row][num] & self.row_windows[col][num]:
+            return False
+        if self.col_masks[col][num] & self.col_windows[row][num]:
+            return False
+        return not self.region_masks[self.region_id[row, col]] & (1 << num)
 
-        if not check_region:
-            return True
+    @staticmethod
+    def within(idx, num):
+        """
+        Return a mask of the positions on a row or column that are within num
+        of the position idx, not including idx itself.
+        :param idx: the position on the row or column
+        :param num: the distance
+        :return: the mask of positions within num of idx
+        """
+        return ((1 << (idx + num + 1)) - (1 << max(idx - num, 0))) & ~(1 << idx)
 
-        # check region
-        region = self.get_region((row, col))
-        return self.is_region_valid(region)
+    @staticmethod
+    def is_line_valid(line):
+        """
+        Check if the given row or column is valid, meaning that every pair of
+        equal numbers in it are further apart than the value of that number.
+        :param line: the row or column to check
+        :return: whether the line is valid
+        """
+        for value in np.unique(line[line != 0]):
+            idx = np.flatnonzero(line == value)
+            if idx.size > 1 and np.any(np.diff(idx) <= value):
+                return False
+        return True
 
     def is_region_valid(self, region):
         """
@@ -136,51 +173,42 @@ class Puzzle:
         :param region: the region to check
         :return: whether region is valid
         """
-        if region is None:
-            return False
-        else:
-            seen = set()
-            for square in region:
-                number = self.get(square)
-                if number in seen:
-                    return False
-                if number != ".":
-                    seen.add(number)
-
+        seen = 0
+        for number in self.puzzle[region].tolist():
+            bit = 1 << number
+            if number != 0 and seen & bit:
+                return False
+            seen |= bit
         return True
 
-    def is_solved(self):
+    def is_consistent(self):
         """
-        Test if this puzzle has been solved.
-        :return: True if the puzzle is solved, False otherwise
+        Check that the numbers already in this puzzle break no rules, meaning
+        every row, column and region is valid. This is run once on the givens
+        when a puzzle is read, since every number placed afterwards is
+        validated by test().
+        :return: whether every row, column and region is valid
         """
-        if self.solved:
-            return True
-        if self.empty_slots_left > 0:
-            return False
-
-        # check that each square is filled
         for row in range(self.height):
-            for col in range(self.width):
-                if self.puzzle[row][col] == ".":
-                    return False
-
-        # check each row and column
-        col = 0
-        for row in range(self.height):
-            col = col % self.width
-            if not self.is_valid(row, col, False):
+            if not self.is_line_valid(self.puzzle[row]):
+                return False
+        for col in range(self.width):
+            if not self.is_line_valid(self.puzzle[:, col]):
                 return False
-            col += 1
-
-        # check each region
         for region in self.regions:
             if not self.is_region_valid(region):
                 return False
-
-        self.solved = True
         return True
 
+    def is_solved(self):
+        """
+        Test if this puzzle has been solved. The givens are checked when the
+        puzzle is read, and every number placed with test() is validated, so
+        the puzzle is solved once no empty squares are left.
+        :return: True if the puzzle is solved, False otherwise
+        """
+        return self.empty_slots_left == 0
+
     def backtrack(self, row, col):
         """
         Backtrack by resetting the square at the given row and column to its
@@ -189,19 +217,21 @@ class Puzzle:
         :param col: the given column
         :return: None
         """
-        self.puzzle[row][col] = "."
-        self.empty_slots_left += 1
+        num = int(self.puzzle[row, col])
+        if num != 0:
+            self.puzzle[row, col] = 0
+            self.empty_slots_left += 1
+            self.row_masks[row][num] &= ~(1 << col)
+            self.col_masks[col][num] &= ~(1 << row)
+            self.region_masks[self.region_id[row, col]] &= ~(1 << num)
 
     def copy(self):
         """
         Return a deep copy of this puzzle.
         :return: a deep copy of this puzzle
         """
-        puzzle_copy = [[0 for _ in range(self.width)] for __ in range(self.height)]
-        for row in range(self.height):
-            for col in range(self.width):
-                puzzle_copy[row][col] = self.puzzle[row][col]
-        return Puzzle(self.width, self.height, puzzle_copy, self.puzzle_str, self.regions, self.region_map)
+        return Puzzle(self.width, self.height, self.puzzle.copy(), self.puzzle_str, self.regions, self.region_id,
+                      self.influence)
 
 
 def solve_region(row, col, width, height, puzzle, has_region):
@@ -215,44 +245,82 @@ def solve_region(row, col, width, height, puzzle, has_region):
     :param has_region: the set of squares that are already part of a region
     :return: a tuple containing all squares that make up the region
     """
-    str_row = (2 * row) + 1
-    str_col = (2 * col) + 1
-    has_region.add((row, col))
-    new_squares = []
-    # check above
-    if row > 0:
-        if puzzle[str_row - 1][str_col] == " ":
-            new_squares.append((row - 1, col))
-
-    # check below
-    if row + 1 < height:
-        if puzzle[str_row + 1][str_col] == " ":
-            new_squares.append((row + 1, col))
-
-    # check left
-    if col > 0:
-        if puzzle[str_row][str_col - 1] == " ":
-            new_squares.append((row, col - 1))
-
-    # check right
-    if col + 1 < width:
-        if puzzle[str_row][str_col + 1] == " ":
-            new_squares.append((row, col + 1))
-
-    result = [(row, col)]
-    for square in new_squares:
-        if square not in has_region:
-            result.extend(solve_region(square[0], square[1], width, height, puzzle, has_region))
+    result = []
+    to_visit = [(row, col)]
+    while to_visit:
+        row, col = to_visit.pop()
+        if (row, col) in has_region:
+            continue
+        has_region.add((row, col))
+        result.append((row, col))
+
+        str_row = (2 * row) + 1
+        str_col = (2 * col) + 1
+        new_squares = []
+        # check above
+        if row > 0:
+            if puzzle[str_row - 1][str_col] == " ":
+                new_squares.append((row - 1, col))
+
+        # check below
+        if row + 1 < height:
+            if puzzle[str_row + 1][str_col] == " ":
+                new_squares.append((row + 1, col))
+
+        # check left
+        if col > 0:
+            if puzzle[str_row][str_col - 1] == " ":
+                new_squares.append((row, col - 1))
+
+        # check right
+        if col + 1 < width:
+            if puzzle[str_row][str_col + 1] == " ":
+                new_squares.append((row, col + 1))
+
+        # push in reverse so squares are visited in the order they were found
+        for square in reversed(new_squares):
+            if square not in has_region:
+                to_visit.append(square)
 
     return tuple(result)
 
 
+def find_influence(width, height, regions, region_id):
+    """
+    Find the squares influenced by placing each possible value in each square,
+    meaning the squares that can no longer hold that value: the squares within
+    value of it on its row and column, and every square in its region.
+    :param width: the width of the puzzle
+    :param height: the height of the puzzle
+    :param regions: the regions of the puzzle
+    :param region_id: the index of the region containing each square
+    :return: a boolean array where influence[row, col, value] is a mask over
+             the flattened puzzle of the squares influenced by placing value
+             at (row, col)
+    """
+    max_value = max(region[0].size for region in regions)
+    row = np.arange(height)[:, None, None, None, None]
+    col = np.arange(width)[None, :, None, None, None]
+    value = np.arange(max_value + 1)[None, None, :, None, None]
+    other_row = np.arange(height)[None, None, None, :, None]
+    other_col = np.arange(width)[None, None, None, None, :]
+
+    same_row = (other_row == row) & (np.abs(other_col - col) <= value)
+    same_col = (other_col == col) & (np.abs(other_row - row) <= value)
+    same_region = region_id[None, None, None, :, :] == region_id[:, :, None, None, None]
+    influence = same_row | same_col | same_region
+    return influence.reshape(height, width, max_value + 1, height * width)
+
+
 def read_puzzle(file_name):
     """
     Read in a Ripple Effect puzzle from a file, and create a Puzzle object to
     represent it.
     :param file_name: the name of the file containing the Ripple Effect puzzle
     :return: the Puzzle object representing the Ripple Effect puzzle
+    :raises ValueError: if the numbers given in the puzzle break its rules, or
+                        a region has more squares than the intelligent
+                        solver's Heuristic.MAX_VALUE
     """
     # read file
     with open(file_name) as f:
@@ -268,25 +336,24 @@ def read_puzzle(file_name):
     # solve regions
     has_region = set()
     regions = []
-    region_map = dict()
+    region_id = np.empty((height, width), dtype=np.int16)
     for row in range(height):
         for col in range(width):
             if (row, col) not in has_region:
                 result = solve_region(row, col, width, height, puzzle, has_region)
-                regions.append(result)
                 for square in result:
-                    region_map[square] = result
+                    region_id[square] = len(regions)
+                region_rows, region_cols = zip(*result)
+                regions.append((np.array(region_rows), np.array(region_cols)))
 
-    # create puzzle array
-    puzzle_squares = [[0 for _ in range(width)] for __ in range(height)]
+    # create puzzle array, with empty squares stored as 0
+    puzzle_squares = np.zeros((height, width), dtype=np.int8)
     for row in range(height):
         for col in range(width):
             str_row = (2 * row) + 1
             str_col = (2 * col) + 1
-            if puzzle[str_row][str_col] == ".":
-                puzzle_squares[row][col] = "."
-            else:
-                puzzle_squares[row][col] = int(puzzle[str_row][str_col])
+            if puzzle[str_row][str_col] != ".":
+                puzzle_squares[row, col] = int(puzzle[str_row][str_col])
 
     # create puzzle string for printing
     puzzle_str = []
@@ -308,8 +375,23 @@ def read_puzzle(file_name):
             puzzle_str.append(new_line)
             row += 1
 
-    # return the created puzzle object
-    return Puzzle(width, height, puzzle_squares, puzzle_str, regions, region_map)
+    # check that no given is larger than its region, before the masks sized by
+    # the largest region are built
+    region_size = np.array([region[0].size for region in regions])[region_id]
+    if region_size.max() > Heuristic.MAX_VALUE:
+        raise ValueError(file_name + " has a region of more than " + str(Heuristic.MAX_VALUE)
+                         + " squares, which the intelligent solver cannot hold")
+    if np.any(puzzle_squares > region_size):
+        raise ValueError("the numbers given in " + file_name + " break the rules of the puzzle")
+
+    # find the squares influenced by placing each value in each square
+    influence = find_influence(width, height, regions, region_id)
+
+    # check the givens, and return the created puzzle object
+    result = Puzzle(width, height, puzzle_squares, puzzle_str, regions, region_id, influence)
+    if not result.is_consistent():
+        raise ValueError("the numbers given in " + file_name + " break the rules of the puzzle")
+    return result
 
 
 def compare(puzzle_file, print_solved_puzzle=False):
@@ -322,7 +404,11 @@ def compare(puzzle_file, print_solved_puzzle=False):
     :return: None
     """
     # get the puzzle
-    puzzle = read_puzzle(puzzle_file)
+    try:
+        puzzle = read_puzzle(puzzle_file)
+    except ValueError as e:
+        print("Invalid puzzle:", e)
+        return
 
     # run the brute force solver
     puzzle_copy_1 = puzzle.copy()
@@ -335,7 +421,9 @@ def compare(puzzle_file, print_solved_puzzle=False):
         print(brute_force)
     print()
 
-    # run the intelligent solver
+    # run the intelligent solver, after compiling its search so that the
+    # compile time is not counted
+    Heuristic.warm_up()
     puzzle_copy_2 = puzzle.copy()
     start = time.perf_counter()
     heuristic, heuristic_calls = Heuristic.solve(puzzle_copy_2, True)